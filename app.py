@@ -1,7 +1,9 @@
 import streamlit as st
 from datetime import date
-import json
+import ijson
+import os
 import random
+from utils.serialization import loads
 
 # app layout
 st.set_page_config(
@@ -39,11 +41,69 @@ quotes = [
 ]
 st.markdown(f"*{random.choice(quotes)}*")
 
-# load in data
-with open("./data/generated-map.json", "r") as f:
-    data_dict = json.load(f)
-    max_date = date.fromisoformat(max(data_dict.keys())) # convert to date object
-    min_date = date.fromisoformat(min(data_dict.keys())) # convert to date object
+MAP_FILE_PATH = "./data/generated-map.json"
+STREAM_MIN_BYTES = 1_000_000 # below this size, a full json.load is cheaper than streaming the map
+
+@st.cache_data(ttl=3600)
+def load_map(path: str, mtime: float):
+    """
+    Load the generated map and its date range, cached across reruns and sessions.
+
+    `mtime` is only part of the cache key, so edits to the file bust the cache.
+    """
+    with open(path, "rb") as f:
+        data_dict = loads(f.read())
+    # keys are ISO YYYY-MM-DD strings, so string comparison is date order and only
+    # the two endpoints need converting to date objects
+    min_date = date.fromisoformat(min(data_dict))
+    max_date = date.fromisoformat(max(data_dict))
+    return data_dict, min_date, max_date
+
+@st.cache_data(ttl=3600)
+def get_date_range(path: str, mtime: float):
+    """
+    Get the (min, max) dates in the generated map. Large maps are streamed, scanning only their top-level keys.
+    """
+    if os.path.getsize(path) < STREAM_MIN_BYTES:
+        _, min_date, max_date = load_map(path, mtime)
+        return min_date, max_date
+
+    min_key = max_key = None
+    with open(path, "rb") as f:
+        for prefix, event, key in ijson.parse(f):
+            if prefix == "" and event == "map_key":
+                min_key = key if min_key is None else min(min_key, key)
+                max_key = key if max_key is None else max(max_key, key)
+    return date.fromisoformat(min_key), date.fromisoformat(max_key)
+
+@st.cache_data(ttl=3600)
+def get_entry(path: str, mtime: float, date_str: str):
+    """
+    Get the generated map entry for a date, or None if there isn't one. Large maps are streamed until the entry is found.
+    """
+    if os.path.getsize(path) < STREAM_MIN_BYTES:
+        data_dict, _, _ = load_map(path, mtime)
+        return data_dict.get(date_str)
+
+    with open(path, "rb") as f:
+        for key, entry in ijson.kvitems(f, "", use_float=True):
+            if key == date_str:
+                return entry
+    return None
+
+@st.cache_data(max_entries=32)
+def load_image(path: str, mtime: float) -> bytes:
+    """
+    Load an image's bytes, cached so re-selecting a date doesn't re-read it from disk. `max_entries` bounds memory.
+    """
+    with open(path, "rb") as f:
+        return f.read()
+
+# load in data once per session; later reruns (e.g. picking a date) skip the stat and cache lookup
+if "map_state" not in st.session_state:
+    map_mtime = os.path.getmtime(MAP_FILE_PATH)
+    st.session_state.map_state = (map_mtime, *get_date_range(MAP_FILE_PATH, map_mtime))
+map_mtime, min_date, max_date = st.session_state.map_state
 
 # Create a date input widget with default value as today
 selected_date = st.date_input(
@@ -59,9 +119,9 @@ st.divider()
 # Convert selected_date to string in YYYY-MM-DD format
 selected_date_str = selected_date.strftime("%Y-%m-%d")
 
-# Check if selected date is in data_dict
-if selected_date_str in data_dict:
-    entry = data_dict[selected_date_str]
+# Check if there is an entry for the selected date
+entry = get_entry(MAP_FILE_PATH, map_mtime, selected_date_str)
+if entry is not None:
     image_path = entry["image_path"]
     story_summary = entry["story_summary"]
     story_url = entry["story_url"]
@@ -75,7 +135,7 @@ if selected_date_str in data_dict:
         
         with st.container():
             st.markdown('<div class="hover-zoom">', unsafe_allow_html=True)
-            st.image(image_path)
+            st.image(load_image(image_path, os.path.getmtime(image_path)))
             st.markdown('</div>', unsafe_allow_html=True)
         
         # Make the story title more prominent
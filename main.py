@@ -1,31 +1,105 @@
 import os
-import json
+import io
+import asyncio
+import heapq
+from functools import lru_cache
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from tqdm import tqdm
 import sys
 import logging
+import atexit
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from config import CONFIG
-from utils.search import search_bing
+from utils.search import search_bing_async
 from utils.validation import extract_search_results
 from utils.ai import (
     validate_news_stories, create_image_gen_prompt, \
     generate_image, validate_generated_image,
     summarize_webpage, validate_webpage_content
 )
-from utils.scraping import get_page_text_content
+from utils.scraping import new_async_client, fetch_page_text
+from utils.serialization import loads, dumps_bytes
+from utils.cache import get_cached_story, update_cached_story
 import requests
+import httpx
+from PIL import Image
 
 # Set up logging configuration
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('main.log'),
-        logging.StreamHandler()  # Also print to console
-    ]
-)
+# records are handed off to a queue and written to the file/console on a background thread,
+# so logging never blocks the scraping and LLM calls
+log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+log_handlers = [
+    logging.FileHandler('main.log'),
+    logging.StreamHandler()  # Also print to console
+]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+
+log_queue = queue.Queue(-1)
+# not basicConfig: it would give the queue handler a default formatter, prefixing every message twice
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.INFO)
+root_logger.addHandler(QueueHandler(log_queue))
+log_listener = QueueListener(log_queue, *log_handlers)
+log_listener.start()
+atexit.register(log_listener.stop) # flush remaining records on exit
 logger = logging.getLogger(__name__)
 
+def format_published_date(date_str: str) -> str:
+    """
+    Convert an ISO publish date (e.g. "2024-10-27T14:03:00.0000000Z") to a readable format (e.g. "October 27, 2024").
+    """
+    # drop the "Z" suffix and fractional seconds, which fromisoformat doesn't need (Bing uses 7 digits)
+    date_str = date_str.rstrip('Z').split('.')[0]
+    return datetime.fromisoformat(date_str).strftime("%B %d, %Y")
+
+# parsed generated maps, keyed by path, as (mtime, map) -- lets consecutive reads and writes skip re-parsing
+_MAP_CACHE = {}
+
+def read_map(path: str) -> dict:
+    """
+    Read a generated map, reusing the parsed copy when the file hasn't changed since it was last read or written.
+    Returns a shallow copy, so callers can add entries without touching the cache.
+    """
+    mtime = os.path.getmtime(path)
+    cached = _MAP_CACHE.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1].copy()
+
+    with open(path, 'rb') as f:
+        generated_map = loads(f.read())
+    _MAP_CACHE[path] = (mtime, generated_map)
+    return generated_map.copy()
+
+def write_map(path: str, generated_map: dict):
+    """
+    Write a generated map to a temp file and atomically swap it in, so a failed
+    write can never leave a truncated map behind for the app to load.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(dumps_bytes(generated_map))
+    os.replace(tmp_path, path)
+    _MAP_CACHE[path] = (os.path.getmtime(path), generated_map.copy())
+
+def link_most_recent_image(image_path: str, recent_path: str):
+    """
+    Point `recent_path` at `image_path` with a hard link, so the image bytes are only written once.
+    Falls back to a copy on filesystems without hard link support.
+    """
+    try:
+        os.remove(recent_path)
+    except FileNotFoundError:
+        pass
+
+    try:
+        os.link(image_path, recent_path)
+    except OSError:
+        shutil.copyfile(image_path, recent_path)
+
 # get current datetime YYYY-MM-DD-HH-MM-SS
 run_start_time = datetime.now().strftime("%Y%m%d-%H%M%S")
 
@@ -35,62 +109,186 @@ logger.info(f"Processing {len(CONFIG['search_queries'])} search terms: {CONFIG['
 ### read in search terms from ./config.py file
 search_terms = CONFIG["search_queries"]
 
-### Iterate through each search term and get the search results
-search_results = []
-for search_term in tqdm(search_terms, desc="Searching Bing with Search Terms", total=len(search_terms)):
-    try:
-        result = search_bing(search_term)
-        search_results.append(result)
-        logger.info(f"Successfully retrieved {len(result)} results for search term: {search_term}")
-    except Exception as e:
-        logger.error(f"Error searching for term '{search_term}': {str(e)}")
+# single progress bar for the whole run; each phase adds its steps to the total as they become known
+# (disable=None turns it off when not attached to a terminal, e.g. in CI logs)
+progress = tqdm(total=len(search_terms), desc="Running pipeline", mininterval=1.0, disable=None)
+
+async def search_all(search_terms: list[str], max_concurrency: int = 20) -> list[dict]:
+    """
+    Search Bing for all search terms concurrently, skipping (and logging) any term that fails.
+    """
+    sem = asyncio.Semaphore(max_concurrency)
+
+    async def search_one(client, search_term: str):
+        async with sem:
+            try:
+                result = await search_bing_async(search_term, client)
+                logger.info(f"Successfully retrieved {len(result)} results for search term: {search_term}")
+                return result
+            except Exception as e:
+                logger.error(f"Error searching for term '{search_term}': {str(e)}")
+                return None
+            finally:
+                progress.update(1)
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        results = await asyncio.gather(*(search_one(client, search_term) for search_term in search_terms))
+    return [result for result in results if result is not None]
+
+### Get the search results for all search terms concurrently
+search_results = asyncio.run(search_all(search_terms))
 
 values = extract_search_results(search_results)
 
 logger.info(f"Extracted {len(values)} valid search results")
 
+def cached_validate_news_stories(values: list[dict], tqdm_desc: str = None) -> list[dict]:
+    """
+    Validate the news stories, only calling the LLM for stories whose URL isn't already cached from a previous run.
+    Stories that could not be ranked are returned as None.
+    """
+    rankings = [get_cached_story(value['url']).get('ranking_info') for value in values]
+    misses = [idx for idx, ranking_info in enumerate(rankings) if ranking_info is None]
+    logger.info(f"Found {len(values) - len(misses)} cached story rankings, validating {len(misses)} new stories")
+
+    if misses:
+        new_rankings = validate_news_stories([values[idx] for idx in misses], tqdm_desc=tqdm_desc)
+
+        for idx, ranking_info in zip(misses, new_rankings):
+            rankings[idx] = ranking_info
+            if ranking_info is not None:
+                update_cached_story(values[idx]['url'], ranking_info=ranking_info)
+
+    return rankings
+
+def cached_validate_webpage_content(url: str, webpage_text: str) -> bool:
+    """
+    Validate the webpage content, reusing the cached result for this URL from a previous run if there is one.
+    """
+    webpage_valid = get_cached_story(url).get('webpage_valid')
+    if webpage_valid is None:
+        webpage_valid = validate_webpage_content(webpage_text)
+        update_cached_story(url, webpage_valid=webpage_valid)
+    return webpage_valid
+
 # validate the news stories
 logger.info("Starting news story validation")
-rankings = validate_news_stories(values, tqdm_desc="Validating news stories")
+rankings = cached_validate_news_stories(values, tqdm_desc="Validating news stories")
 
 # Create a new list combining rankings with original story data
 stories_rankings = []
 for idx, ranking_info in enumerate(rankings):
+    if ranking_info is None:
+        continue
     stories_rankings.append({
         'ranking': ranking_info['ranking'],
         'result': values[idx]  # Original story data from values
     })
 
-logger.info(f"Completed story validation. Highest ranking: {max([r['ranking'] for r in stories_rankings])}")
+logger.info(f"Completed story validation. Highest ranking: {max(r['ranking'] for r in stories_rankings)}")
 
-# sort by ranking (now using stories_rankings instead of rankings)
-rankings_stories = sorted(stories_rankings, key=lambda x: x['ranking'], reverse=True)
+# keep only the top candidates, sorted by ranking (now using stories_rankings instead of rankings)
+max_candidate_stories = 10
+rankings_stories = heapq.nlargest(max_candidate_stories, stories_rankings, key=lambda x: x['ranking'])
 
-logger.info(f"Found {len(rankings_stories)} stories with maximum ranking of {max([r['ranking'] for r in rankings_stories])}")
+logger.info(f"Found {len(rankings_stories)} stories with maximum ranking of {rankings_stories[0]['ranking']}")
 
-# Get text content for top stories
-valid_story_index = None
-for idx, story in enumerate(tqdm(rankings_stories, desc="Trying to get text content")):
-    url = story['result']['url']  # Changed from story['result']['url']
-    try:
-        response = get_page_text_content(url=url, timeout=10)
-        if response.strip() and len(response.strip().split()) > 300: # ensure there's enough content
-            story['text_content'] = response
-            logger.info(f"Successfully retrieved content from URL: {url}")
-
-            # add check to AI-validate the text content
-            if not validate_webpage_content(story['text_content']):
-                logger.error(f"Failed to validate content for {url}")
-                continue
+async def find_valid_story(stories: list[dict], num_scrapers: int = 10, num_validators: int = 5):
+    """
+    Scrape and AI-validate the candidate stories as a pipeline: scraper workers push each fetched page onto a queue
+    consumed by validator workers, so validation starts as soon as the first page arrives.
 
-            # if we made it here, we have a valid story
-            else:
-                valid_story_index = idx  # Store the index of the valid story
-                logger.info(f"Successfully validated content for {url}")
-                break
-    except Exception as e:
-        logger.error(f"Error getting content for {url}: {str(e)}")
-        continue
+    Returns the index of the highest-ranked story with valid content (setting its 'text_content'), or None.
+    Stops as soon as that story is known, i.e. once it's valid and every higher-ranked story has failed.
+    """
+    if not stories:
+        return None
+
+    loop = asyncio.get_running_loop()
+    validation_executor = ThreadPoolExecutor(max_workers=num_validators)
+    url_queue = asyncio.Queue()
+    text_queue = asyncio.Queue()
+    for idx in range(len(stories)):
+        url_queue.put_nowait(idx)
+
+    outcomes = {} # story index -> whether its content is valid
+    decided = asyncio.Event()
+
+    def best_valid_index():
+        for idx in range(len(stories)):
+            if idx not in outcomes:
+                return None # still waiting on a higher-ranked story
+            if outcomes[idx]:
+                return idx
+        return None
+
+    def record(idx: int, valid: bool):
+        outcomes[idx] = valid
+        progress.update(1)
+        if best_valid_index() is not None or len(outcomes) == len(stories):
+            decided.set()
+
+    async def scraper(client):
+        while not url_queue.empty():
+            idx = url_queue.get_nowait()
+            url = stories[idx]['result']['url']
+            try:
+                text = await fetch_page_text(client, url)
+            except Exception as e:
+                logger.error(f"Error getting content for {url}: {str(e)}")
+                text = ""
+            text_queue.put_nowait((idx, text))
+
+    async def validator():
+        while True:
+            item = await text_queue.get()
+            if item is None:
+                return
+            idx, response = item
+            story = stories[idx]
+            url = story['result']['url']
+            try:
+                if response.strip() and len(response.strip().split()) > 300: # ensure there's enough content
+                    logger.info(f"Successfully retrieved content from URL: {url}")
+
+                    # add check to AI-validate the text content
+                    if not await loop.run_in_executor(validation_executor, cached_validate_webpage_content, url, response):
+                        logger.error(f"Failed to validate content for {url}")
+                        record(idx, False)
+                    else:
+                        story['text_content'] = response
+                        logger.info(f"Successfully validated content for {url}")
+                        record(idx, True)
+                else:
+                    record(idx, False)
+            except Exception as e:
+                logger.error(f"Error getting content for {url}: {str(e)}")
+                record(idx, False)
+
+    async def run_scrapers(client):
+        await asyncio.gather(*(scraper(client) for _ in range(num_scrapers)))
+        for _ in range(num_validators):
+            text_queue.put_nowait(None) # no more pages; let the validators finish
+
+    async with new_async_client(timeout=10) as client:
+        tasks = [asyncio.ensure_future(run_scrapers(client))]
+        tasks += [asyncio.ensure_future(validator()) for _ in range(num_validators)]
+        try:
+            await decided.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # don't block on validations of stories that can no longer win
+            validation_executor.shutdown(wait=False, cancel_futures=True)
+
+    return best_valid_index()
+
+# Get text content for top stories, scraping and validating them as a pipeline,
+# while still preferring the highest-ranked valid story
+progress.total += len(rankings_stories)
+progress.refresh()
+valid_story_index = asyncio.run(find_valid_story(rankings_stories))
 
 if valid_story_index is None:
     logger.error("Failed to find any valid story content")
@@ -98,126 +296,173 @@ if valid_story_index is None:
 
 # Use the valid story for both summary and URL
 chosen_story = rankings_stories[valid_story_index]
-chosen_story_summary = summarize_webpage(chosen_story['text_content'], tqdm_desc="Generating story summary")
+chosen_story_summary = summarize_webpage(chosen_story['text_content'])
+
+if chosen_story_summary is None:
+    logger.error("Failed to summarize the chosen story")
+    sys.exit(1)
 
 logger.info("Starting image generation and validation process")
 image_dir = "./data/images"
 image_gen_attempts = 5
 score_threshold = 8
 file_type = "png"
-feedback = None
+output_file_type = "webp" # generated images are transcoded to this before saving
+progress.total += image_gen_attempts
+progress.refresh()
 
-for attempt in range(1, image_gen_attempts + 1):
-    logger.info(f"Attempt {attempt}/{image_gen_attempts} to generate valid image")
-    
-    try:
-        # Format feedback as improvement suggestions if available
-        formatted_feedback = None
-        if feedback and isinstance(feedback, dict):
-            formatted_feedback = {
-                "improvements_needed": [
-                    f"Improve {k.replace('_', ' ')}" 
-                    for k, v in feedback.items() 
-                    if v < score_threshold
-                ]
-            }
-        
+@lru_cache(maxsize=64)
+def improvement_label(criterion: str) -> str:
+    """
+    Label for a validation criterion that needs improving, e.g. "text_legibility" -> "Improve text legibility".
+    """
+    return f"Improve {criterion.replace('_', ' ')}"
+
+def format_feedback(feedback):
+    """
+    Format image validation scores as improvement suggestions, if available.
+    """
+    if feedback and isinstance(feedback, dict):
+        return {
+            "improvements_needed": [
+                improvement_label(k)
+                for k, v in feedback.items() 
+                if v < score_threshold
+            ]
+        }
+    return None
+
+async def run_image_attempts():
+    """
+    Generate and validate images until one meets the quality criteria, returning (attempt, image_prompt, image_bytes),
+    or None if every attempt fails.
+
+    The next attempt is generated speculatively while the current one is being validated, so it only sees feedback
+    up to the previous attempt. Once an image passes, the outstanding attempt is abandoned: if it hasn't reached
+    `generate_image` yet it never will, but a generation already in flight runs to completion (and is paid for).
+    """
+    loop = asyncio.get_running_loop()
+    # 2 slots: the current attempt's validation overlaps the next attempt's generation
+    executor = ThreadPoolExecutor(max_workers=2)
+
+    async def generate_candidate(attempt: int, feedback):
         # Generate new prompt with formatted feedback
-        image_prompt = create_image_gen_prompt(
+        image_prompt = await loop.run_in_executor(executor, lambda: create_image_gen_prompt(
             story_text=chosen_story_summary,
             model="o1-mini-2024-09-12",
-            feedback=formatted_feedback,
+            feedback=format_feedback(feedback),
             tqdm_desc=f"Creating image generation prompt (attempt {attempt}/{image_gen_attempts})"
-        )
+        ))
         image_prompt = image_prompt[0]['full_prompt']
-        logger.info(f"Generated prompt: {image_prompt}")
-
-        generated_image_bytes = generate_image(image_prompt, file_type=file_type)
-        image_validation = validate_generated_image(generated_image_bytes, image_prompt)
-
-        logger.info(f"Image validation: {image_validation}")
-        
-        if isinstance(image_validation, dict):
-            # Calculate mean of text-related scores
-            text_scores = [v for k, v in image_validation.items() if 'text' in k.lower()]
-            text_mean = sum(text_scores) / len(text_scores) if text_scores else 0
-            
-            # Calculate mean of all scores
-            all_scores = list(image_validation.values())
-            overall_mean = sum(all_scores) / len(all_scores) if all_scores else 0
-            
-            logger.info(f"Text score mean: {text_mean:.2f}, Overall mean: {overall_mean:.2f}")
-            
-            # Check if the image meets the quality criteria
-            # if text_mean > score_threshold and overall_mean > score_threshold:
-            if overall_mean > score_threshold:
-                logger.info("Generated image meets quality criteria")
-                
-                # Save the successful image
-                output_filename = f'./data/images/{run_start_time}-{attempt}.{file_type}'
-                with open(output_filename, 'wb') as f:
-                    f.write(generated_image_bytes)
-                logger.info(f"Successfully saved generated image to {output_filename}")
-
-                # Update the generated-map.json file
-                map_file_path = "./data/generated-map.json"
-                # Get current date in local timezone
-                current_date = datetime.now().astimezone().strftime("%Y-%m-%d")
+        logger.info(f"Generated prompt (attempt {attempt}): {image_prompt}")
+
+        generated_image_bytes, generated_image_url = await loop.run_in_executor(executor, lambda: generate_image(image_prompt, file_type=file_type))
+        return image_prompt, generated_image_bytes, generated_image_url
+
+    feedback = None
+    next_candidate = asyncio.ensure_future(generate_candidate(1, feedback))
+    try:
+        for attempt in range(1, image_gen_attempts + 1):
+            logger.info(f"Attempt {attempt}/{image_gen_attempts} to generate valid image")
+            progress.update(1)
+            candidate, next_candidate = next_candidate, None
+
+            try:
+                image_prompt, generated_image_bytes, generated_image_url = await candidate
+
+                # kick off the next attempt before validating this one
+                if attempt < image_gen_attempts:
+                    next_candidate = asyncio.ensure_future(generate_candidate(attempt + 1, feedback))
+
+                # the hosted image is passed by URL (used when the validation model supports URL sources, else sent as base64)
+                image_validation = await loop.run_in_executor(executor, lambda: validate_generated_image(generated_image_bytes, image_prompt, image_url=generated_image_url))
+
+                logger.info(f"Image validation: {image_validation}")
                 
-                try:
-                    # Read existing map if it exists
-                    if os.path.exists(map_file_path):
-                        with open(map_file_path, 'r') as f:
-                            generated_map = json.load(f)
-
-                        # also write the file to "./data/most-recent-image.png" -- this will be rendered in the README
-                        with open("./data/most-recent-image.png", 'wb') as f:
-                            f.write(generated_image_bytes)
-                    else:
-                        generated_map = {}
+                if isinstance(image_validation, dict):
+                    # Calculate mean of text-related scores
+                    text_scores = [v for k, v in image_validation.items() if 'text' in k.lower()]
+                    text_mean = sum(text_scores) / len(text_scores) if text_scores else 0
                     
-                    # Find the date field from the result dictionary
-                    date_value = None
-                    for key in rankings_stories[0]['result']:
-                        if 'date' in key.lower():
-                            date_value = rankings_stories[0]['result'][key]
-                            break
-
-                    # Convert ISO date format to readable format
-                    date_str = rankings_stories[0]['result']['datePublished']
-                    try:
-                        # Try the full ISO format first
-                        formatted_date = datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S.%fZ").strftime("%B %d, %Y")
-                    except ValueError:
-                        try:
-                            # Try without milliseconds
-                            formatted_date = datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%SZ").strftime("%B %d, %Y")
-                        except ValueError:
-                            # If all else fails, just use the date portion
-                            formatted_date = datetime.strptime(date_str.split('T')[0], "%Y-%m-%d").strftime("%B %d, %Y")
-
-                    generated_map[current_date] = {
-                        "date": formatted_date,
-                        "image_path": output_filename,
-                        "story_summary": chosen_story_summary['summary'],
-                        "story_url": chosen_story['result']['url'],
-                        **chosen_story['result']
-                    }
+                    # Calculate mean of all scores
+                    all_scores = list(image_validation.values())
+                    overall_mean = sum(all_scores) / len(all_scores) if all_scores else 0
                     
-                    # Write updated map back to file
-                    with open(map_file_path, 'w') as f:
-                        json.dump(generated_map, f, indent=4)
+                    logger.info(f"Text score mean: {text_mean:.2f}, Overall mean: {overall_mean:.2f}")
                     
-                    logger.info(f"Successfully updated generated-map.json for date {current_date}")
-                except Exception as e:
-                    logger.error(f"Error updating generated-map.json: {str(e)}")
-                
+                    # Check if the image meets the quality criteria
+                    # if text_mean > score_threshold and overall_mean > score_threshold:
+                    if overall_mean > score_threshold:
+                        logger.info("Generated image meets quality criteria")
+                        return attempt, image_prompt, generated_image_bytes
+                    else:
+                        logger.info("Image quality below threshold. Updating prompt with feedback and retrying...")
+                        feedback = image_validation  # Store validation results for later attempts
+
+            except Exception as e:
+                logger.error(f"Error in attempt {attempt}: {str(e)}")
+                feedback = None  # Reset feedback on error
+                if next_candidate is None and attempt < image_gen_attempts:
+                    next_candidate = asyncio.ensure_future(generate_candidate(attempt + 1, feedback))
+                continue
+
+        return None
+    finally:
+        if next_candidate is not None:
+            next_candidate.cancel()
+        # drop queued work so an abandoned attempt can't start a new generation; a call already running in the pool
+        # can't be interrupted, and the interpreter still waits for it at exit
+        executor.shutdown(wait=False, cancel_futures=True)
+
+image_result = asyncio.run(run_image_attempts())
+progress.close()
+
+if image_result is None:
+    logger.error("Failed to generate an image meeting the quality criteria")
+else:
+    attempt, image_prompt, generated_image_bytes = image_result
+
+    # Save the successful image as WebP, which is several times smaller than PNG at this quality
+    output_filename = f'./data/images/{run_start_time}-{attempt}.{output_file_type}'
+    Image.open(io.BytesIO(generated_image_bytes)).save(output_filename, 'WEBP', quality=90, method=6)
+    logger.info(f"Successfully saved generated image to {output_filename}")
+
+    # Update the generated-map.json file
+    map_file_path = "./data/generated-map.json"
+    # Get current date in local timezone
+    current_date = datetime.now().astimezone().strftime("%Y-%m-%d")
+
+    try:
+        # Read existing map if it exists
+        if os.path.exists(map_file_path):
+            generated_map = read_map(map_file_path)
+
+            # also link the file to "./data/most-recent-image.webp" -- this will be rendered in the README
+            link_most_recent_image(output_filename, f"./data/most-recent-image.{output_file_type}")
+        else:
+            generated_map = {}
+
+        # Find the date field from the result dictionary
+        date_value = None
+        for key in rankings_stories[0]['result']:
+            if 'date' in key.lower():
+                date_value = rankings_stories[0]['result'][key]
                 break
-            else:
-                logger.info("Image quality below threshold. Updating prompt with feedback and retrying...")
-                feedback = image_validation  # Store validation results for next attempt
-                
+
+        # Convert ISO date format to readable format
+        formatted_date = format_published_date(rankings_stories[0]['result']['datePublished'])
+
+        generated_map[current_date] = {
+            "date": formatted_date,
+            "image_path": output_filename,
+            "story_summary": chosen_story_summary['summary'],
+            "story_url": chosen_story['result']['url'],
+            **chosen_story['result']
+        }
+
+        # Write updated map back to file
+        write_map(map_file_path, generated_map)
+
+        logger.info(f"Successfully updated generated-map.json for date {current_date}")
     except Exception as e:
-        logger.error(f"Error in attempt {attempt}: {str(e)}")
-        feedback = None  # Reset feedback on error
-        continue
+        logger.error(f"Error updating generated-map.json: {str(e)}")
@@ -1,143 +1,605 @@
 # utils for interacting with the OpenAI API
 
 import os
-import json
-from openai import OpenAI
+import asyncio
+import logging
+from string import Template
+from contextlib import aclosing
+import ijson
+import tiktoken
+from functools import lru_cache
+from openai import OpenAI, AsyncOpenAI
 import anthropic
 import replicate
-from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
-from tqdm import tqdm
-import requests
-import base64
+from tqdm.asyncio import tqdm as tqdm_asyncio
+from pydantic import BaseModel
+from utils.cache import llm_cache, CACHE_EXPIRE, prompt_cache_key, semantic_scope, find_similar_response, add_similar_response
+from utils.http import new_session
+from utils.serialization import loads, dumps
+# SIMD-accelerated base64, several times faster on large images
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
 from datetime import datetime
 
+# transient errors (connection errors, rate limits, server errors) are retried by the clients themselves,
+# with exponential backoff that honors the server's retry-after header (every client uses the same policy)
+MAX_RETRIES = 3
+
 client = OpenAI(
-    api_key=os.environ['OPENAI_API_KEY']
+    api_key=os.environ['OPENAI_API_KEY'],
+    max_retries=MAX_RETRIES
 )
 
+logger = logging.getLogger(__name__)
+
 anthropic_client = anthropic.Anthropic(
-    api_key=os.getenv("ANTHROPIC_API_KEY")
+    api_key=os.getenv("ANTHROPIC_API_KEY"),
+    max_retries=MAX_RETRIES
+)
+
+# shared session so image downloads from Replicate's CDN reuse a pooled keep-alive connection
+_SESSION = new_session()
+
+# response schemas, enforced server-side with structured outputs so replies always parse
+class NewsRanking(BaseModel):
+    ranking: float
+    explanation: str
+
+class IndexedNewsRanking(NewsRanking):
+    idx: int
+
+class NewsRankings(BaseModel):
+    rankings: list[IndexedNewsRanking]
+
+class WebpageSummary(BaseModel):
+    summary: str
+    word_count: int
+
+class IndexedWebpageSummary(WebpageSummary):
+    idx: int
+
+class WebpageSummaries(BaseModel):
+    summaries: list[IndexedWebpageSummary]
+
+class ImageGenPrompt(BaseModel):
+    full_prompt: str
+
+class ImageValidation(BaseModel):
+    text_accuracy: float
+    text_legibility: float
+    text_coherence: float
+    character_diversity: float
+    theme_relevance: float
+    emotional_impact: float
+    visual_appeal: float
+    clarity: float
+    cohesiveness: float
+    creativity: float
+    uplifting_suitability: float
+
+class IndexedImageValidation(ImageValidation):
+    idx: int
+
+class ImageValidations(BaseModel):
+    validations: list[IndexedImageValidation]
+
+# static instructions are sent once as a system message (a prompt cache hit after the first call),
+# so only the per-call data goes in the user message
+# the story criteria shared by headline ranking and webpage validation
+STORY_CRITERIA = """
+1. **Local Focus with Authenticity**: The story should highlight individuals, small communities, or local efforts, especially those from diverse backgrounds, in a way that respects their unique identity and contributions rather than framing them solely as recipients of help.
+2. **Non-Celebrity**: The story should not feature major celebrities or public figures, focusing instead on everyday people with relatable experiences.
+3. **Non-Political**: Avoid headlines that involve politics, government policy, or political issues to keep the tone universally positive and inclusive.
+4. **Uplifting and Positive**: The story should genuinely uplift, leaving a sense of joy, hope, or inspiration without relying on stereotypes, ‘savior’ narratives, or overly simplistic portrayals of resilience.
+5. **Acts of Kindness or Community Support**: Bonus points for stories involving selfless acts of kindness, collaboration, or personal achievement, especially if the community itself drives the action rather than external groups.
+6. **Uncommon and Nuanced**: Prefer stories that are unique, insightful, or pleasantly surprising. Avoid overly sentimental or generic stories; instead, favor those that offer a fresh perspective on positive human experiences.
+7. **Avoid Tragic or Simplistic Narratives**: Headlines should avoid themes of tragedy, pity, or hardship, even if the ultimate outcome is positive. Additionally, avoid content that feels voyeuristic or reduces people’s lives to simplistic narratives.
+8. **Visual Potential with Respect**: Consider whether the story could be effectively conveyed through a cartoon format that honors the dignity of all characters involved. Stories should have a visual element that celebrates life without trivializing it.
+9. **Empowerment Over Dependency**: Focus on stories that celebrate agency, where individuals or communities are portrayed as capable and empowered rather than as subjects of intervention. The narrative should respect autonomy and celebrate mutual aid, rather than emphasizing dependency or external rescue.
+10. **Cultural Sensitivity and Representation**: Be mindful of stories that involve cultural practices, traditions, or lifestyles, ensuring they are represented respectfully and without sensationalism or exoticism. Prefer stories that offer an inclusive, accurate portrayal of diverse experiences, fostering genuine understanding and connection.
+11. **Avoid Fetishization**: Avoid content that fetishizes or objectifies individuals, especially those from marginalized or vulnerable communities. Ensure that the portrayal of characters is respectful and not exploitative.
+12. **Avoid Clickbait**: Headlines should not be misleading or sensationalized to drive clicks, but rather should provide genuine value and inform readers about meaningful, uplifting stories.
+""".strip()
+
+RANKING_CRITERIA = """
+# Ranking Criteria
+Use the following criteria to guide your ranking:
+{story_criteria}
+""".strip().format(
+    story_criteria=STORY_CRITERIA,
+)
+
+SYSTEM_VALIDATE = """
+# Instruction
+You are an expert evaluator for a project dedicated to creating AI-generated cartoons that spread joy and positivity.
+Your task is to read the headline you are given and assess how well it aligns with our mission of delivering uplifting, feel-good content
+that can be transformed into inspiring cartoons.
+Additionally, you must also factor in quality of the source. We don't want spam or clickbait, but we also don't want to miss out on a good story.
+
+Use an overall ranking from 0.00 to 10.00, rounded to the nearest hundreth, where lower scores indicate poor alignment and higher scores indicate good alignment.
+Include a brief explanation for your ranking, in no more than 1-2 sentences, max 30 words.
+Your response must be in a strict JSON dictionary format on a single line, to be parsed easily by a python function.
+Your response must not include any backticks, code blocks, or other formatting, as this will break the JSON parsing.
+
+{ranking_criteria}
+
+# Example Response
+{example_response}
+""".strip().format(
+    ranking_criteria=RANKING_CRITERIA,
+    example_response=dumps({"ranking": 3.45, "explanation": "This headline ..."}),
+)
+
+SYSTEM_VALIDATE_BATCH = """
+# Instruction
+You are an expert evaluator for a project dedicated to creating AI-generated cartoons that spread joy and positivity.
+Your task is to read each of the headlines you are given and independently assess how well it aligns with our mission of delivering uplifting, feel-good content
+that can be transformed into inspiring cartoons.
+Additionally, you must also factor in quality of the source. We don't want spam or clickbait, but we also don't want to miss out on a good story.
+
+Use an overall ranking from 0.00 to 10.00 for each headline, rounded to the nearest hundreth, where lower scores indicate poor alignment and higher scores indicate good alignment.
+Include a brief explanation for each ranking, in no more than 1-2 sentences, max 30 words.
+Every headline has an "idx" field; include it unchanged with its ranking, and rank every headline exactly once.
+Your response must be in a strict JSON dictionary format on a single line, to be parsed easily by a python function.
+Your response must not include any backticks, code blocks, or other formatting, as this will break the JSON parsing.
+
+{ranking_criteria}
+
+# Example Response
+{example_response}
+""".strip().format(
+    ranking_criteria=RANKING_CRITERIA,
+    example_response=dumps({"rankings": [{"idx": 0, "ranking": 3.45, "explanation": "This headline ..."}, {"idx": 1, "ranking": 7.80, "explanation": "This headline ..."}]}),
+)
+
+# formatted per call with today's date
+EXAMPLE_SUMMARY = dumps({"summary": "Brief summary of key points...", "word_count": 150})
+
+SYSTEM_SUMMARIZE = """
+# Instruction
+You are a skilled content summarizer.
+Extract and condense the most important elements of the story you are given into a clear, engaging summary of less than 200 words.
+Focus on the key narrative points while maintaining the emotional core of the story.
+In particular, think about how this story could be transformed into a cartoon.
+Remain faithful to the original story, but also think about how to visualize it in a cartoon.
+However, do not explicitly mention the visual style, not any mention of a cartoon in your summary.
+You MUST use double newlines ("\n\n") to separate your summary into small, easily readable paragraphs for the user.
+
+NOTE:
+- This summary will serve as both a story summary for the user that provides context to the image,
+as well as story context for the image generation model.
+- Be sure to use markdown formatting, including bolding and italicizing, to make the summary more engaging.
+- Write it grammatically in a tense that reads naturally for a user reading about this story the day it was written. Therefore, mirror the tense of the original story.
+- Begin the summary with the location of the story, if mentioned in the story ("location_x --"), else put "Location unknown --" at the start, with the date of the story {today_date}
+
+Your response must be in a strict JSON dictionary format on a single line, to be parsed easily by a python function.
+Include both the summary and its word count in your response.
+Your response must not include any backticks, code blocks, or other formatting, as this will break the JSON parsing.
+You must use exactly the same JSON structure and key(s) as in the example response, otherwise parsing will fail.
+
+# Example Response
+{example_response}
+""".strip()
+
+# formatted per call with today's date
+EXAMPLE_SUMMARIES = dumps({"summaries": [{"idx": 0, "summary": "Brief summary of key points...", "word_count": 150}, {"idx": 1, "summary": "Brief summary of key points...", "word_count": 120}]})
+
+SYSTEM_SUMMARIZE_BATCH = """
+# Instruction
+You are a skilled content summarizer.
+You are given several stories, each with an "idx" field. Summarize EACH story separately and independently, never mixing details between stories.
+For each story, extract and condense its most important elements into a clear, engaging summary of less than 200 words.
+Focus on the key narrative points while maintaining the emotional core of the story.
+In particular, think about how this story could be transformed into a cartoon.
+Remain faithful to the original story, but also think about how to visualize it in a cartoon.
+However, do not explicitly mention the visual style, not any mention of a cartoon in your summary.
+You MUST use double newlines ("\n\n") to separate each summary into small, easily readable paragraphs for the user.
+
+NOTE:
+- Each summary will serve as both a story summary for the user that provides context to the image,
+as well as story context for the image generation model.
+- Be sure to use markdown formatting, including bolding and italicizing, to make the summaries more engaging.
+- Write each summary grammatically in a tense that reads naturally for a user reading about this story the day it was written. Therefore, mirror the tense of the original story.
+- Begin each summary with the location of the story, if mentioned in the story ("location_x --"), else put "Location unknown --" at the start, with the date of the story {today_date}
+
+Your response must be in a strict JSON dictionary format on a single line, to be parsed easily by a python function.
+Include each story's "idx" unchanged, its summary and the summary's word count, and summarize every story exactly once.
+Your response must not include any backticks, code blocks, or other formatting, as this will break the JSON parsing.
+You must use exactly the same JSON structure and key(s) as in the example response, otherwise parsing will fail.
+
+# Example Response
+{example_response}
+""".strip()
+
+SYSTEM_IMAGE_GEN_PROMPT = """
+# Instruction
+Write an instruction prompt that generates an image in 200 words or less in the following style:
+The scene shows the story you are given using loose, confident ink brush strokes and gentle gray watercolor shading.
+You must return your response in a strict JSON dictionary format on a single line, to be parsed easily by a python function.
+Your response must not include any backticks, code blocks, or other formatting, as this will break the JSON parsing.
+
+# Style
+Key style elements:
+- Any human characters in the image must be diverse in terms of age, gender, and ethnicity
+- Be creative with the artistic style - consider various approaches like watercolor, digital art, pencil sketches, bold colors, or minimalist designs
+- Feel free to experiment with different compositions, perspectives, and layouts
+- The mood and tone should match the story's emotional content
+- Visual elements should support and enhance the narrative
+- Maintain clear focus on the key story elements
+- Consider including symbolic or metaphorical elements that reinforce the story's message
+- Do NOT include any text in the image
+
+# Example Response
+{example_response}
+""".strip().format(
+    example_response=dumps({"full_prompt": "..."}),
+)
+
+# substituted per call with the content to evaluate; a Template, so braces in the example JSON need no escaping
+VALIDATE_WEBPAGE_PROMPT = Template("""
+# Instruction
+You are an expert evaluator for a project dedicated to creating AI-generated cartoons that spread joy and positivity.
+Your task is to read the following content and determine if it aligns with our mission of delivering uplifting, feel-good content
+that can be transformed into inspiring cartoons.
+
+Return ONLY a string response with either "true" or "false".
+
+# Criteria
+{story_criteria}
+
+# Content to Evaluate
+$content
+
+# Example Response
+{example_response}
+
+# Your Response (only valid options are "true" or "false")
+""".strip().format(
+    story_criteria=STORY_CRITERIA,
+    example_response=dumps(True),
+))
+
+# the rubric shared by the single and batched image validation prompts
+IMAGE_GRADING_CRITERIA = """
+# Grading Criteria
+- text_accuracy (0-10): The text caption's accuracy and match with the image generation prompt
+- text_legibility (0-10): How readable and clear the text caption is for humans
+- text_coherence (0-10): How well the text caption makes sense in the image context
+- character_diversity (0-10): Diversity of human characters in terms of age, gender, ethnicity, and physical ability
+- theme_relevance (0-10): How closely the image matches its intended theme or subject
+- emotional_impact (0-10): How well it evokes positive emotions (joy, hope, inspiration, warmth)
+- visual_appeal (0-10): Quality of composition, colors, and style, without distracting elements
+- clarity (0-10): Clarity of content without blur, distortion, or artifacts
+- cohesiveness (0-10): How harmoniously all elements work together
+- creativity (0-10): Level of uniqueness and originality, avoiding clichés
+- uplifting_suitability (0-10): Alignment with light-hearted, joyful narratives
+""".strip()
+
+# substituted per call with the prompt used to generate the image
+VALIDATE_IMAGE_PROMPT = Template("""
+# Instruction
+You are an expert evaluator of images.
+You need to evaluate how well the image aligns with the following criteria.
+Your explanation should be in no more than 1-2 sentences, max 30 words.
+For each criterion, provide a score between 0.00 and 10.00, using decimal precision to reflect nuance.
+
+{grading_criteria}
+
+# Prompt Used to Generate Image
+$image_gen_prompt
+
+Provide a single score between 0.00 (does not meet any criteria) to 10.00 (perfectly meets all criteria), considering all the above aspects.
+Use decimal precision, rounded to the nearest hundredth to reflect nuance.
+
+# Example Response
+{example_response}
+""".strip().format(
+    grading_criteria=IMAGE_GRADING_CRITERIA,
+    example_response=dumps({"text_accuracy": 8.50,"text_legibility": 7.25,"text_coherence": 9.00,"character_diversity": 6.75,"theme_relevance": 8.50,"emotional_impact": 7.00,"visual_appeal": 8.25,"clarity": 9.50,"cohesiveness": 8.00,"creativity": 7.75,"uplifting_suitability": 8.50}),
+))
+
+VALIDATE_IMAGES_PROMPT = """
+# Instruction
+You are an expert evaluator of images.
+You will be shown several images, each preceded by its index and the prompt used to generate it.
+Score each image independently against the following criteria, comparing it only to its own prompt.
+For each criterion, provide a score between 0.00 and 10.00, using decimal precision to reflect nuance.
+
+{grading_criteria}
+
+Return one entry per image, with "idx" set to the index of the image it scores.
+""".strip().format(
+    grading_criteria=IMAGE_GRADING_CRITERIA,
 )
 
-def batch_prompt_oai(prompts: list[str], 
+def _build_messages(prompt: str | tuple[str, str], model: str) -> list[dict]:
+    """
+    Build the chat messages for a prompt that is either a user message or a (system, user) message pair.
+    """
+    if isinstance(prompt, tuple):
+        system, user = prompt
+    else:
+        system, user = None, prompt
+
+    if model.startswith("o1"):
+        # o1 models support neither system messages nor response formats, so rely on the prompt
+        content = f"{system}\n\n{user}" if system else user
+        return [{"role": "user", "content": content}]
+
+    return [
+        {
+            "role": "system", 
+            "content": system or "You always return information in a strict JSON dictionary format one ONE line, to be parsed easily by a python function."
+        },
+        {"role": "user", "content": user}
+    ]
+
+async def batch_prompt_oai_async(prompts: list[str | tuple[str, str]], 
                     model: str = "gpt-4o-mini-2024-07-18", 
                     max_workers: int = 20,
                     timeout: int = 30,
-                    tqdm_desc: str = None) -> list[dict]:
+                    tqdm_desc: str = None,
+                    response_format: type[BaseModel] = None,
+                    use_cache: bool = True,
+                    semantic_cache: bool = False) -> list[dict]:
     """
-    Process multiple prompts concurrently using the OpenAI API.
+    Process multiple prompts concurrently using the async OpenAI API, on the running event loop.
+
+    Responses are cached on disk, keyed by the exact request. With `semantic_cache`, a miss is also
+    checked against the embeddings of previously cached user messages sent with the same model, system message
+    and response format, reusing a near-identical prompt's response.
     
     Args:
-        prompts: List of prompts to process
+        prompts: List of prompts to process, each either a user message or a (system, user) message pair
         model: OpenAI model to use
-        max_workers: Maximum number of concurrent threads
+        max_workers: Maximum number of concurrent requests
         timeout: Timeout in seconds for each API call
         tqdm_desc: Description for the progress bar (defaults to "Processing prompts")
+        response_format: Pydantic model the responses must match (ignored by o1 models, which don't support it)
+        use_cache: Whether to reuse and store cached responses (disable for prompts that should vary between calls)
+        semantic_cache: Whether to also reuse responses for semantically similar prompts (costs an embedding call per miss)
     
     Returns:
-        List of API responses in the same order as the input prompts
+        List of API responses in the same order as the input prompts, with None for any prompt that failed
     """
-    def _process_single_prompt(prompt: str):
-        messages = [{"role": "user", "content": prompt}]
-        
-        if not model.startswith("o1"):
-            messages.insert(0, {
-                "role": "system", 
-                "content": "You always return information in a strict JSON dictionary format one ONE line, to be parsed easily by a python function."
-            })
-
-        completion = client.chat.completions.create(
-            model=model,
-            messages=messages
-        )
-        
-        response_str = completion.choices[0].message.content.strip()
-        return json.loads(response_str)
-
-    results = []
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {
-            executor.submit(_process_single_prompt, prompt): i 
-            for i, prompt in enumerate(prompts)
-        }
-        
-        for future in tqdm(as_completed(futures), 
+    sem = asyncio.Semaphore(max_workers)
+
+    # the async client's connection pool is bound to the event loop it's used on, so it lives for one batch
+    async with AsyncOpenAI(api_key=os.environ['OPENAI_API_KEY'], max_retries=MAX_RETRIES) as async_client:
+        # the timeout is enforced per request by the client itself, rather than by the consumer waiting on results
+        async_client = async_client.with_options(timeout=timeout)
+
+        async def _request(messages: list[dict]):
+            if model.startswith("o1"):
+                completion = await async_client.chat.completions.create(
+                    model=model,
+                    messages=messages
+                )
+                response_str = completion.choices[0].message.content.strip()
+                return loads(response_str)
+
+            if response_format is None:
+                completion = await async_client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    response_format={"type": "json_object"}
+                )
+                return loads(completion.choices[0].message.content)
+
+            completion = await async_client.beta.chat.completions.parse(
+                model=model,
+                messages=messages,
+                response_format=response_format
+            )
+            message = completion.choices[0].message
+            if message.parsed is None:
+                raise ValueError(f"Model refused to respond: {message.refusal}")
+            return message.parsed.model_dump()
+
+        async def _process_single_prompt(prompt: str | tuple[str, str]):
+            messages = _build_messages(prompt, model)
+
+            if not use_cache:
+                return await _request(messages)
+
+            key = prompt_cache_key(model, messages, response_format.__name__ if response_format else None)
+            response = llm_cache.get(key)
+            if response is not None:
+                return response
+
+            embedding = None
+            if semantic_cache:
+                # only the per-call data is embedded (the shared instructions would dominate the vector),
+                # and only matched against prompts with the same model, instructions and response format
+                system, user = prompt if isinstance(prompt, tuple) else (None, prompt)
+                scope = semantic_scope(model, system, response_format.__name__ if response_format else None)
+                try:
+                    embedding = (await async_client.embeddings.create(
+                        model="text-embedding-3-small",
+                        input=user
+                    )).data[0].embedding
+                    response = await asyncio.to_thread(find_similar_response, scope, embedding)
+                    if response is not None:
+                        return response
+                except Exception as e:
+                    # the semantic tier is only an optimization, so fall through to the real request
+                    logger.warning(f"Semantic cache lookup failed: {e!r}")
+
+            response = await _request(messages)
+
+            # write to disk off the event loop
+            await asyncio.to_thread(llm_cache.set, key, response, expire=CACHE_EXPIRE)
+            if embedding is not None:
+                await asyncio.to_thread(add_similar_response, scope, key, embedding, response)
+            return response
+
+        async def _bounded(idx: int, prompt: str | tuple[str, str]):
+            async with sem:
+                try:
+                    return idx, await _process_single_prompt(prompt)
+                except Exception as e:
+                    # leave a gap the caller can retry, rather than failing the whole batch
+                    logger.warning(f"Prompt {idx} failed: {e!r}")
+                    return idx, None
+
+        results = [None] * len(prompts)
+        tasks = [_bounded(i, prompt) for i, prompt in enumerate(prompts)]
+        # disable=None silences the bar when not attached to a terminal (e.g. CI logs)
+        for future in tqdm_asyncio.as_completed(tasks, 
                          total=len(prompts),
-                         desc=tqdm_desc or "Processing prompts"):
-            idx = futures[future]
-            try:
-                with tqdm(total=timeout, 
-                         desc="Timeout", 
-                         unit="s", 
-                         leave=False) as pbar:
-                    for _ in range(timeout):
-                        try:
-                            result = future.result(timeout=1)
-                            results.append((idx, result))
-                            break
-                        except TimeoutError:
-                            pbar.update(1)
-                            continue
-            except Exception as e:
-                # just skip it. It's not a big deal.
-                continue
-    
-    # Sort results back to original order
-    results.sort(key=lambda x: x[0])
-    return [r[1] for r in results]
+                         desc=tqdm_desc or "Processing prompts",
+                         mininterval=1.0,
+                         disable=None):
+            idx, result = await future
+            results[idx] = result
+
+    return results
 
-def validate_news_stories(results: list[dict[str, str]], tqdm_desc: str = None, model: str = "gpt-4o-mini-2024-07-18"):
+async def stream_prompt_oai_async(prompt: str | tuple[str, str],
+                    model: str = "gpt-4o-mini-2024-07-18",
+                    timeout: int = 30,
+                    response_format: type[BaseModel] = None):
     """
-    Use the OpenAI API to validate a news story against a set of criteria.
+    Stream the JSON response to a single prompt, yielding each top-level (key, value) pair as soon as it has been
+    fully generated, so the caller can act on early fields without waiting for the rest of the completion.
+
+    Args:
+        prompt: Either a user message or a (system, user) message pair
+        model: OpenAI model to use
+        timeout: Timeout in seconds for the API call
+        response_format: Pydantic model the response must match (ignored by o1 models, which don't support it)
+
+    Yields:
+        (key, value) pairs of the response object, in the order the model generates them
+    """
+    messages = _build_messages(prompt, model)
+
+    # parses the JSON incrementally as chunks are sent in, collecting each completed top-level field
+    fields = ijson.sendable_list()
+    parser = ijson.kvitems_coro(fields, "", use_float=True)
+
+    async with AsyncOpenAI(api_key=os.environ['OPENAI_API_KEY'], max_retries=MAX_RETRIES) as async_client:
+        async_client = async_client.with_options(timeout=timeout)
+
+        async def _deltas():
+            if model.startswith("o1"):
+                stream = await async_client.chat.completions.create(model=model, messages=messages, stream=True)
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+                return
+
+            async with async_client.beta.chat.completions.stream(
+                model=model,
+                messages=messages,
+                response_format=response_format or {"type": "json_object"}
+            ) as stream:
+                async for event in stream:
+                    if event.type == "refusal.done":
+                        raise ValueError(f"Model refused to respond: {event.refusal}")
+                    if event.type == "content.delta":
+                        yield event.delta
+
+        async with aclosing(_deltas()) as deltas:
+            async for delta in deltas:
+                parser.send(delta.encode())
+                for field in fields:
+                    yield field
+                del fields[:]
+
+    parser.close()
+    for field in fields:
+        yield field
+
+def batch_prompt_oai(prompts: list[str | tuple[str, str]], 
+                    model: str = "gpt-4o-mini-2024-07-18", 
+                    max_workers: int = 20,
+                    timeout: int = 30,
+                    tqdm_desc: str = None,
+                    response_format: type[BaseModel] = None,
+                    use_cache: bool = True,
+                    semantic_cache: bool = False) -> list[dict]:
     """
+    Process multiple prompts concurrently using the OpenAI API.
 
-    example_response = {"ranking": 3.45, "explanation": "This headline ..."}
+    Synchronous wrapper around `batch_prompt_oai_async`, so it must not be called from a running event loop
+    (use `await batch_prompt_oai_async(...)`, or call this from a worker thread, instead).
+    
+    Args:
+        prompts: List of prompts to process, each either a user message or a (system, user) message pair
+        model: OpenAI model to use
+        max_workers: Maximum number of concurrent requests
+        timeout: Timeout in seconds for each API call
+        tqdm_desc: Description for the progress bar (defaults to "Processing prompts")
+        response_format: Pydantic model the responses must match (ignored by o1 models, which don't support it)
+        use_cache: Whether to reuse and store cached responses (disable for prompts that should vary between calls)
+        semantic_cache: Whether to also reuse responses for semantically similar prompts (costs an embedding call per miss)
+    
+    Returns:
+        List of API responses in the same order as the input prompts, with None for any prompt that failed
+    """
+    return asyncio.run(batch_prompt_oai_async(
+        prompts, model=model, max_workers=max_workers, timeout=timeout, tqdm_desc=tqdm_desc,
+        response_format=response_format, use_cache=use_cache, semantic_cache=semantic_cache
+    ))
 
-    base_prompt = """
-    # Instruction
-    You are an expert evaluator for a project dedicated to creating AI-generated cartoons that spread joy and positivity.
-    Your task is to read the following headline and assess how well it aligns with our mission of delivering uplifting, feel-good content
-    that can be transformed into inspiring cartoons.
-    Additionally, you must also factor in quality of the source. We don't want spam or clickbait, but we also don't want to miss out on a good story.
+def retry_failures(prompts: list[str | tuple[str, str]], responses: list[dict | None], **kwargs) -> list[dict | None]:
+    """
+    Re-run only the prompts whose response is None (as returned by `batch_prompt_oai`), and merge the new responses in.
 
-    Use an overall ranking from 0.00 to 10.00, rounded to the nearest hundreth, where lower scores indicate poor alignment and higher scores indicate good alignment.
-    Include a brief explanation for your ranking, in no more than 1-2 sentences, max 30 words.
-    Your response must be in a strict JSON dictionary format on a single line, to be parsed easily by a python function.
-    Your response must not include any backticks, code blocks, or other formatting, as this will break the JSON parsing.
+    Args:
+        prompts: The prompts originally passed to `batch_prompt_oai`
+        responses: The responses it returned, aligned with `prompts`
+        **kwargs: Passed through to `batch_prompt_oai` (e.g. a different `model` for the retry)
 
-    # Ranking Criteria
-    Use the following criteria to guide your ranking:
-    1. **Local Focus with Authenticity**: The story should highlight individuals, small communities, or local efforts, especially those from diverse backgrounds, in a way that respects their unique identity and contributions rather than framing them solely as recipients of help.
-    2. **Non-Celebrity**: The story should not feature major celebrities or public figures, focusing instead on everyday people with relatable experiences.
-    3. **Non-Political**: Avoid headlines that involve politics, government policy, or political issues to keep the tone universally positive and inclusive.
-    4. **Uplifting and Positive**: The story should genuinely uplift, leaving a sense of joy, hope, or inspiration without relying on stereotypes, ‘savior’ narratives, or overly simplistic portrayals of resilience.
-    5. **Acts of Kindness or Community Support**: Bonus points for stories involving selfless acts of kindness, collaboration, or personal achievement, especially if the community itself drives the action rather than external groups.
-    6. **Uncommon and Nuanced**: Prefer stories that are unique, insightful, or pleasantly surprising. Avoid overly sentimental or generic stories; instead, favor those that offer a fresh perspective on positive human experiences.
-    7. **Avoid Tragic or Simplistic Narratives**: Headlines should avoid themes of tragedy, pity, or hardship, even if the ultimate outcome is positive. Additionally, avoid content that feels voyeuristic or reduces people’s lives to simplistic narratives.
-    8. **Visual Potential with Respect**: Consider whether the story could be effectively conveyed through a cartoon format that honors the dignity of all characters involved. Stories should have a visual element that celebrates life without trivializing it.
-    9. **Empowerment Over Dependency**: Focus on stories that celebrate agency, where individuals or communities are portrayed as capable and empowered rather than as subjects of intervention. The narrative should respect autonomy and celebrate mutual aid, rather than emphasizing dependency or external rescue.
-    10. **Cultural Sensitivity and Representation**: Be mindful of stories that involve cultural practices, traditions, or lifestyles, ensuring they are represented respectfully and without sensationalism or exoticism. Prefer stories that offer an inclusive, accurate portrayal of diverse experiences, fostering genuine understanding and connection.
-    11. **Avoid Fetishization**: Avoid content that fetishizes or objectifies individuals, especially those from marginalized or vulnerable communities. Ensure that the portrayal of characters is respectful and not exploitative.
-    12. **Avoid Clickbait**: Headlines should not be misleading or sensationalized to drive clicks, but rather should provide genuine value and inform readers about meaningful, uplifting stories.
+    Returns:
+        List of responses aligned with `prompts`, with None for any prompt that failed again
+    """
+    failed = [idx for idx, response in enumerate(responses) if response is None]
+    if not failed:
+        return list(responses)
 
-    # Headline Information
-    {headline}
+    merged = list(responses)
+    for idx, response in zip(failed, batch_prompt_oai([prompts[idx] for idx in failed], **kwargs)):
+        merged[idx] = response
+    return merged
 
-    # Example Response
-    {example_response}
+def validate_news_stories(results: list[dict[str, str]], tqdm_desc: str = None, model: str = "gpt-4o-mini-2024-07-18", batch_size: int = 10):
+    """
+    Use the OpenAI API to validate news stories against a set of criteria.
 
-    # Your Response
+    Stories are ranked `batch_size` at a time in a single prompt, and any story missing from a batch response
+    is re-ranked on its own. Returns one ranking dict per story, in the same order as `results`,
+    or None for a story that could not be ranked.
     """
 
-    # batch process the results
-    prompts = [
-        base_prompt.format(
-            headline=json.dumps(headline),
-            example_response=json.dumps(example_response),
-        ) for headline in results
+    rankings = [None] * len(results)
+
+    # batch process the results, several headlines per prompt
+    batches = [
+        [{"idx": idx, **headline} for idx, headline in enumerate(results[start:start + batch_size], start=start)]
+        for start in range(0, len(results), batch_size)
     ]
+    prompts = [(SYSTEM_VALIDATE_BATCH, dumps(batch)) for batch in batches]
 
-    return batch_prompt_oai(prompts, model=model, tqdm_desc=tqdm_desc)
+    for response in batch_prompt_oai(prompts, model=model, max_workers=5, tqdm_desc=tqdm_desc, response_format=NewsRankings):
+        for item in response.get("rankings", []) if isinstance(response, dict) else []:
+            idx = item.get("idx") if isinstance(item, dict) else None
+            if isinstance(idx, int) and 0 <= idx < len(results) and "ranking" in item:
+                rankings[idx] = {"ranking": item["ranking"], "explanation": item.get("explanation", "")}
+
+    # fall back to one prompt per headline for anything the batches missed
+    missing = [idx for idx, ranking_info in enumerate(rankings) if ranking_info is None]
+    if missing:
+        prompts = [(SYSTEM_VALIDATE, dumps(results[idx])) for idx in missing]
+        # near-duplicate headlines (the same story syndicated under a reworded title) reuse a cached ranking
+        fallback_rankings = batch_prompt_oai(prompts, model=model, tqdm_desc=tqdm_desc, response_format=NewsRanking, semantic_cache=True)
+        for idx, ranking_info in zip(missing, fallback_rankings):
+            rankings[idx] = ranking_info
+
+    return rankings
 
 def validate_webpage_content(webpage_text: str) -> bool:
     """
@@ -151,112 +613,174 @@ def validate_webpage_content(webpage_text: str) -> bool:
     Returns:
         bool: True if content passes validation, False otherwise
     """
-    example_response = True
-
-    base_prompt = """
-    # Instruction
-    You are an expert evaluator for a project dedicated to creating AI-generated cartoons that spread joy and positivity.
-    Your task is to read the following content and determine if it aligns with our mission of delivering uplifting, feel-good content
-    that can be transformed into inspiring cartoons.
-
-    Return ONLY a string response with either "true" or "false".
-
-    # Criteria
-    1. **Local Focus with Authenticity**: The story should highlight individuals, small communities, or local efforts, especially those from diverse backgrounds, in a way that respects their unique identity and contributions rather than framing them solely as recipients of help.
-    2. **Non-Celebrity**: The story should not feature major celebrities or public figures, focusing instead on everyday people with relatable experiences.
-    3. **Non-Political**: Avoid headlines that involve politics, government policy, or political issues to keep the tone universally positive and inclusive.
-    4. **Uplifting and Positive**: The story should genuinely uplift, leaving a sense of joy, hope, or inspiration without relying on stereotypes, ‘savior’ narratives, or overly simplistic portrayals of resilience.
-    5. **Acts of Kindness or Community Support**: Bonus points for stories involving selfless acts of kindness, collaboration, or personal achievement, especially if the community itself drives the action rather than external groups.
-    6. **Uncommon and Nuanced**: Prefer stories that are unique, insightful, or pleasantly surprising. Avoid overly sentimental or generic stories; instead, favor those that offer a fresh perspective on positive human experiences.
-    7. **Avoid Tragic or Simplistic Narratives**: Headlines should avoid themes of tragedy, pity, or hardship, even if the ultimate outcome is positive. Additionally, avoid content that feels voyeuristic or reduces people’s lives to simplistic narratives.
-    8. **Visual Potential with Respect**: Consider whether the story could be effectively conveyed through a cartoon format that honors the dignity of all characters involved. Stories should have a visual element that celebrates life without trivializing it.
-    9. **Empowerment Over Dependency**: Focus on stories that celebrate agency, where individuals or communities are portrayed as capable and empowered rather than as subjects of intervention. The narrative should respect autonomy and celebrate mutual aid, rather than emphasizing dependency or external rescue.
-    10. **Cultural Sensitivity and Representation**: Be mindful of stories that involve cultural practices, traditions, or lifestyles, ensuring they are represented respectfully and without sensationalism or exoticism. Prefer stories that offer an inclusive, accurate portrayal of diverse experiences, fostering genuine understanding and connection.
-    11. **Avoid Fetishization**: Avoid content that fetishizes or objectifies individuals, especially those from marginalized or vulnerable communities. Ensure that the portrayal of characters is respectful and not exploitative.
-    12. **Avoid Clickbait**: Headlines should not be misleading or sensationalized to drive clicks, but rather should provide genuine value and inform readers about meaningful, uplifting stories.
-
-    # Content to Evaluate
-    {content}
-
-    # Example Response
-    {example_response}
-
-    # Your Response (only valid options are "true" or "false")
-    """
-
     message = anthropic_client.messages.create(
         model="claude-3-5-sonnet-20241022",
         max_tokens=10, # don't need a high token limit here
         messages=[
-            {"role": "user", "content": base_prompt.format(
-                content=json.dumps(webpage_text),
-                example_response=json.dumps(example_response)
-            )}
+            {"role": "user", "content": VALIDATE_WEBPAGE_PROMPT.substitute(content=dumps(webpage_text))}
         ]
     )
 
     return message.content[0].text.strip().lower().startswith("true") # case insensitive, stripped
 
-def re_validate_news_stories(results: list[dict[str, str]], tqdm_desc: str = None, model: str = "o1-mini-2024-09-12"):
+def re_validate_news_stories(results: list[dict[str, str]], rankings: list[dict | None], tqdm_desc: str = None, model: str = "o1-mini-2024-09-12"):
+    """
+    Re-rank, with a (stronger) model, only the stories `validate_news_stories` could not rank.
+    Returns the merged rankings, aligned with `results`, with None for a story that still could not be ranked.
+    """
+    prompts = [(SYSTEM_VALIDATE, dumps(headline)) for headline in results]
+    return retry_failures(prompts, rankings, model=model, tqdm_desc=tqdm_desc, response_format=NewsRanking, semantic_cache=True)
+
+CHARS_PER_TOKEN = 4 # rough average for English text, used when the tokenizer can't be loaded
+
+@lru_cache(maxsize=1)
+def _encoding() -> tiktoken.Encoding | None:
+    """
+    Tokenizer used to budget prompt sizes (loaded on first use, as it may need to be downloaded),
+    or None if it can't be loaded (e.g. offline), in which case token counts are estimated from characters.
     """
-    Re-validate the news stories to ensure they are still valid.
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning(f"Could not load the tokenizer, estimating token counts from characters: {e!r}")
+        return None
+
+def count_tokens(text: str) -> int:
     """
-    return validate_news_stories(results, tqdm_desc, model)
+    Count the tokens in a string, as the OpenAI models tokenize it.
+    """
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_tokens(text: str, max_tokens: int = 3000, head_tokens: int = 2000) -> str:
+    """
+    Truncate text longer than `max_tokens` to its first `head_tokens` and last `max_tokens - head_tokens` tokens,
+    keeping the lede and the closing section of an article while dropping the middle.
+    """
+    head_tokens = min(head_tokens, max_tokens)
+    tail_tokens = max_tokens - head_tokens
+
+    encoding = _encoding()
+    if encoding is None:
+        if len(text) <= max_tokens * CHARS_PER_TOKEN:
+            return text
+        return text[:head_tokens * CHARS_PER_TOKEN] + "\n...\n" + text[len(text) - tail_tokens * CHARS_PER_TOKEN:]
+
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:head_tokens]) + "\n...\n" + encoding.decode(tokens[len(tokens) - tail_tokens:])
 
-def summarize_webpage(webpage_text: str, model: str = "o1-mini-2024-09-12", tqdm_desc: str = None):
+async def summarize_webpage_async(webpage_text: str, model: str = "o1-mini-2024-09-12", max_tokens: int = 3000):
     """
     Summarize webpage content into key story points in less than 200 words.
+
+    Long webpages are truncated to `max_tokens` (keeping the start and end of the article) before being sent.
+    The response is streamed, and returned as soon as the summary itself is complete rather than after the whole completion.
     
     Args:
         webpage_text: String containing the webpage content
         model: OpenAI model to use
-        tqdm_desc: Description for the progress bar
+        max_tokens: Maximum number of tokens of the webpage content to send
     
     Returns:
-        Dictionary containing the summary
-    """
-    example_response = {"summary": "Brief summary of key points..."}
-
-    base_prompt = """
-    # Instruction
-    You are a skilled content summarizer.
-    Extract and condense the most important elements of this story into a clear, engaging summary of less than 200 words.
-    Focus on the key narrative points while maintaining the emotional core of the story.
-    In particular, think about how this story could be transformed into a cartoon.
-    Remain faithful to the original story, but also think about how to visualize it in a cartoon.
-    However, do not explicitly mention the visual style, not any mention of a cartoon in your summary.
-    You MUST use double newlines ("\n\n") to separate your summary into small, easily readable paragraphs for the user.
-
-    NOTE:
-    - This summary will serve as both a story summary for the user that provides context to the image,
-    as well as story context for the image generation model.
-    - Be sure to use markdown formatting, including bolding and italicizing, to make the summary more engaging.
-    - Write it grammatically in a tense that reads naturally for a user reading about this story the day it was written. Therefore, mirror the tense of the original story.
-    - Begin the summary with the location of the story, if mentioned in the story ("location_x --"), else put "Location unknown --" at the start, with the date of the story {today_date}
-
-    Your response must be in a strict JSON dictionary format on a single line, to be parsed easily by a python function.
-    Include both the summary and its word count in your response.
-    Your response must not include any backticks, code blocks, or other formatting, as this will break the JSON parsing.
-    You must use exactly the same JSON structure and key(s) as in the example response, otherwise parsing will fail.
-
-    # Example Response
-    {example_response}
-
-    # Webpage Text
-    {webpage_text}
-    """.replace("    ", "").strip()
+        Dictionary containing the summary, or None if the request failed
+    """
+    system = SYSTEM_SUMMARIZE.format(
+        example_response=EXAMPLE_SUMMARY,
+        today_date=datetime.now().strftime("%B %d, %Y")
+    )
+    prompt = (system, dumps(truncate_tokens(webpage_text, max_tokens)))
+
+    key = prompt_cache_key(model, _build_messages(prompt, model), WebpageSummary.__name__)
+    response = llm_cache.get(key)
+    if response is not None:
+        return response
+
+    try:
+        async with aclosing(stream_prompt_oai_async(prompt, model=model, response_format=WebpageSummary)) as fields:
+            summary = None
+            async for field, value in fields:
+                if field == "summary":
+                    summary = value
+                    break
+    except Exception as e:
+        logger.warning(f"Summarizing webpage failed: {e!r}")
+        return None
+    if summary is None:
+        logger.warning("Summarizing webpage failed: the response had no summary")
+        return None
+
+    # the word count follows the summary in the response, so count it here instead of waiting for it
+    response = {"summary": summary, "word_count": len(summary.split())}
+    await asyncio.to_thread(llm_cache.set, key, response, expire=CACHE_EXPIRE)
+    return response
+
+def summarize_webpage(webpage_text: str, model: str = "o1-mini-2024-09-12", max_tokens: int = 3000):
+    """
+    Summarize webpage content into key story points in less than 200 words.
 
-    # just one here
+    Synchronous wrapper around `summarize_webpage_async`, so it must not be called from a running event loop.
+    
+    Args:
+        webpage_text: String containing the webpage content
+        model: OpenAI model to use
+        max_tokens: Maximum number of tokens of the webpage content to send
+    
+    Returns:
+        Dictionary containing the summary, or None if the request failed
+    """
+    return asyncio.run(summarize_webpage_async(webpage_text, model=model, max_tokens=max_tokens))
+
+def summarize_webpages(webpage_texts: list[str], model: str = "o1-mini-2024-09-12", batch_size: int = 4, max_batch_tokens: int = 12000, max_tokens: int = 3000, tqdm_desc: str = None):
+    """
+    Summarize several webpages into key story points in less than 200 words each.
+
+    Up to `batch_size` webpages are summarized in a single prompt, as long as together they fit in `max_batch_tokens`,
+    so the instructions are only sent once per batch. Webpages too long to share a prompt, and any missing from a
+    batch response, are summarized on their own. Each webpage is first truncated to `max_tokens`, as in `summarize_webpage`.
+    Returns one summary dict per webpage, in the same order as `webpage_texts`, or None for a webpage that could not be summarized.
+    """
+    today_date = datetime.now().strftime("%B %d, %Y")
+    webpage_texts = [truncate_tokens(webpage_text, max_tokens) for webpage_text in webpage_texts]
+    summaries = [None] * len(webpage_texts)
+
+    # greedily group the webpages, in order, into batches that fit the token budget
+    batches, batch, batch_tokens = [], [], 0
+    for idx, webpage_text in enumerate(webpage_texts):
+        num_tokens = count_tokens(webpage_text)
+        if batch and (len(batch) == batch_size or batch_tokens + num_tokens > max_batch_tokens):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(idx)
+        batch_tokens += num_tokens
+    if batch:
+        batches.append(batch)
+
+    # single-webpage batches (including any over the budget on their own) go straight to the per-webpage prompt
+    system = SYSTEM_SUMMARIZE_BATCH.format(example_response=EXAMPLE_SUMMARIES, today_date=today_date)
     prompts = [
-        base_prompt.format(
-            example_response=json.dumps(example_response),
-            webpage_text=json.dumps(webpage_text),
-            today_date=datetime.now().strftime("%B %d, %Y")
-        )
+        (system, dumps([{"idx": idx, "text": webpage_texts[idx]} for idx in batch]))
+        for batch in batches if len(batch) > 1
     ]
 
-    results = batch_prompt_oai(prompts, model=model, tqdm_desc=tqdm_desc)
-    return results[0] if results else None
+    for response in batch_prompt_oai(prompts, model=model, max_workers=5, tqdm_desc=tqdm_desc, response_format=WebpageSummaries):
+        for item in response.get("summaries", []) if isinstance(response, dict) else []:
+            idx = item.get("idx") if isinstance(item, dict) else None
+            if isinstance(idx, int) and 0 <= idx < len(webpage_texts) and "summary" in item:
+                summaries[idx] = {"summary": item["summary"], "word_count": item.get("word_count", len(item["summary"].split()))}
+
+    missing = [idx for idx, summary in enumerate(summaries) if summary is None]
+    if missing:
+        system = SYSTEM_SUMMARIZE.format(example_response=EXAMPLE_SUMMARY, today_date=today_date)
+        prompts = [(system, dumps(webpage_texts[idx])) for idx in missing]
+        fallback_summaries = batch_prompt_oai(prompts, model=model, tqdm_desc=tqdm_desc, response_format=WebpageSummary)
+        for idx, summary in zip(missing, fallback_summaries):
+            summaries[idx] = summary
+
+    return summaries
 
 def create_image_gen_prompt(story_text: str, model: str = "o1-mini-2024-09-12", tqdm_desc: str = None, feedback: dict[str, float] = None):
     """
@@ -265,48 +789,19 @@ def create_image_gen_prompt(story_text: str, model: str = "o1-mini-2024-09-12",
     Feedback is optional, and can be used to guide the image generation prompt in the event that the image is being re-generated.
     """
     
-    example_response = {"full_prompt":"..."}
-
-    base_prompt = """
-    # Instruction
-    Write an instruction prompt that generates an image in 200 words or less in the following style:
-    The scene shows the following story using loose, confident ink brush strokes and gentle gray watercolor shading.
-    You must return your response in a strict JSON dictionary format on a single line, to be parsed easily by a python function.
-    Your response must not include any backticks, code blocks, or other formatting, as this will break the JSON parsing.
-
-    # Style
-    Key style elements:
-    - Any human characters in the image must be diverse in terms of age, gender, and ethnicity
-    - Be creative with the artistic style - consider various approaches like watercolor, digital art, pencil sketches, bold colors, or minimalist designs
-    - Feel free to experiment with different compositions, perspectives, and layouts
-    - The mood and tone should match the story's emotional content
-    - Visual elements should support and enhance the narrative
-    - Maintain clear focus on the key story elements
-    - Consider including symbolic or metaphorical elements that reinforce the story's message
-    - Do NOT include any text in the image
-
-    # Example Response
-    {example_response}
-
-    # Story
-    {story}
-    """.replace("    ", "").strip()
+    user_prompt = dumps(story_text)
 
     # Add feedback if it exists
     if feedback:
-        base_prompt += f"\n\n# BEFORE GENERATING IMAGE\n"
-        base_prompt += "- You have already tried to generated this image once, and here were the results. Given these weak areas of the previous attempt, be sure to address them even more explicitly in your new prompt:"
-        base_prompt += f"\n\n{json.dumps(feedback)}"
+        user_prompt += f"\n\n# BEFORE GENERATING IMAGE\n"
+        user_prompt += "- You have already tried to generated this image once, and here were the results. Given these weak areas of the previous attempt, be sure to address them even more explicitly in your new prompt:"
+        user_prompt += f"\n\n{dumps(feedback)}"
 
     # just one here
-    prompts = [
-        base_prompt.format(
-            example_response=json.dumps(example_response),
-            story=json.dumps(story_text)
-        )
-    ]
+    prompts = [(SYSTEM_IMAGE_GEN_PROMPT, user_prompt)]
 
-    return batch_prompt_oai(prompts, model=model, tqdm_desc=tqdm_desc)
+    # not cached: retries with the same feedback should still get a fresh prompt
+    return batch_prompt_oai(prompts, model=model, tqdm_desc=tqdm_desc, response_format=ImageGenPrompt, use_cache=False)
 
 def generate_image(prompt: str, model: str = "ideogram", file_type: str = "png"):
     """
@@ -320,7 +815,7 @@ def generate_image(prompt: str, model: str = "ideogram", file_type: str = "png")
         file_type: Output file format (for flux model only)
         
     Returns:
-        bytes: Raw image data if successful, None if failed
+        (bytes, str): Raw image data and the URL it's hosted at (valid for about an hour), so it can be passed by reference
     """
     if model == "flux":
         output = replicate.run(
@@ -336,7 +831,7 @@ def generate_image(prompt: str, model: str = "ideogram", file_type: str = "png")
         )
 
         # download the image
-        return output.read()
+        return output.read(), str(output)
 
     elif model == "ideogram":
         # this returns a URL that requires a GET request to download the image
@@ -353,154 +848,167 @@ def generate_image(prompt: str, model: str = "ideogram", file_type: str = "png")
         )
 
         # download the image
-        return requests.get(output).content
+        return _SESSION.get(output).content, str(output)
     
     else:
         raise ValueError(f"Invalid model: {model}")
 
-def validate_generated_image_old(image_data: bytes, image_gen_prompt: str, model: str = "gpt-4o-2024-08-06"):
+def _is_client_error(error: Exception) -> bool:
+    """
+    Whether an API error is a rejected request (4xx other than a rate limit), which resending as-is won't fix.
+    """
+    status_code = getattr(error, "status_code", None)
+    return status_code is not None and 400 <= status_code < 500 and status_code != 429
+
+def _openai_image_part(image_data: bytes, image_url: str = None) -> dict:
+    """
+    OpenAI message part for an image, referencing it by URL when it's hosted so the bytes aren't re-encoded and uploaded.
+    """
+    if image_url is None:
+        image_url = f"data:image/png;base64,{base64.b64encode(image_data).decode('utf-8')}"
+    return {"type": "image_url", "image_url": {"url": image_url}}
+
+def _anthropic_supports_image_urls(model: str) -> bool:
+    """
+    Whether a Claude model accepts URL image sources (Claude 3.5 and newer); the original Claude 3 models only take base64.
+    """
+    return not model.startswith(("claude-3-opus", "claude-3-sonnet", "claude-3-haiku"))
+
+def _anthropic_image_part(image_data: bytes, image_url: str = None) -> dict:
+    """
+    Anthropic message part for an image, referencing it by URL when it's hosted so the bytes aren't re-encoded and uploaded.
+    """
+    if image_url is not None:
+        source = {"type": "url", "url": image_url}
+    else:
+        source = {"type": "base64", "media_type": "image/png", "data": base64.b64encode(image_data).decode('utf-8')}
+    return {"type": "image", "source": source}
+
+def validate_generated_image_old(image_data: bytes, image_gen_prompt: str, model: str = "gpt-4o-2024-08-06", image_url: str = None):
     """
     Validate the generated image with the given criteria.
+    If image_url is given, the image is sent by reference instead of as base64 data,
+    falling back to base64 if the request is rejected (e.g. the URL has expired or can't be fetched).
     """
-    # Convert bytes to base64
-    base64_image = base64.b64encode(image_data).decode('utf-8')
-    
-    example_response = {"text_accuracy": 8.50,"text_legibility": 7.25,"text_coherence": 9.00,"character_diversity": 6.75,"theme_relevance": 8.50,"emotional_impact": 7.00,"visual_appeal": 8.25,"clarity": 9.50,"cohesiveness": 8.00,"creativity": 7.75,"uplifting_suitability": 8.50}
-
-    base_prompt = """
-    # Instruction
-    You are an expert evaluator of images.
-    You need to evaluate how well the image aligns with the following criteria.
-    Your explanation should be in no more than 1-2 sentences, max 30 words.
-    For each criterion, provide a score between 0.00 and 10.00, using decimal precision to reflect nuance.
-
-    # Grading Criteria
-    - text_accuracy (0-10): The text caption's accuracy and match with the image generation prompt
-    - text_legibility (0-10): How readable and clear the text caption is for humans
-    - text_coherence (0-10): How well the text caption makes sense in the image context
-    - character_diversity (0-10): Diversity of human characters in terms of age, gender, ethnicity, and physical ability
-    - theme_relevance (0-10): How closely the image matches its intended theme or subject
-    - emotional_impact (0-10): How well it evokes positive emotions (joy, hope, inspiration, warmth)
-    - visual_appeal (0-10): Quality of composition, colors, and style, without distracting elements
-    - clarity (0-10): Clarity of content without blur, distortion, or artifacts
-    - cohesiveness (0-10): How harmoniously all elements work together
-    - creativity (0-10): Level of uniqueness and originality, avoiding clichés
-    - uplifting_suitability (0-10): Alignment with light-hearted, joyful narratives
-
-    # Prompt Used to Generate Image
-    {image_gen_prompt}
-
-    Provide a single score between 0.00 (does not meet any criteria) to 10.00 (perfectly meets all criteria), considering all the above aspects.
-    Use decimal precision, rounded to the nearest hundredth to reflect nuance.
-
-    You must return your response in a strict JSON dictionary format on a single line, to be parsed easily by a python function.
-    Your response must not include any backticks, code blocks, or other formatting, as this will break the JSON parsing.
-
-    # Example Response
-    {example_response}
-    """.replace("    ", "").strip()
-
-    for _ in range(3):
+    def _request(image_part: dict) -> dict:
+        response = client.beta.chat.completions.parse(
+            model=model,
+            messages=[
+                {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": VALIDATE_IMAGE_PROMPT.substitute(image_gen_prompt=dumps(image_gen_prompt))},
+                    image_part,
+                ],
+                }
+            ],
+            # max_tokens=200, # no reason to limit this
+            response_format=ImageValidation,
+        )
+        return response.choices[0].message.parsed.model_dump()
+
+    try:
         try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {
+            return _request(_openai_image_part(image_data, image_url))
+        except Exception as e:
+            if image_url is None or not _is_client_error(e):
+                raise
+            return _request(_openai_image_part(image_data))
+    except Exception as e:
+        return f"<|Error validating image: {e}|>"
+
+def validate_generated_image(image_data: bytes, image_gen_prompt: str, model: str = "claude-3-sonnet-20240229", image_url: str = None):
+    """
+    Validate the generated image with the given criteria using Anthropic's Claude API.
+    If image_url is given and the model supports URL sources, the image is sent by reference instead of as base64 data,
+    falling back to base64 if the request is rejected (e.g. the URL has expired or can't be fetched).
+    """
+    if not _anthropic_supports_image_urls(model):
+        image_url = None
+
+    def _request(image_part: dict) -> dict:
+        response = anthropic_client.messages.create(
+            model=model,
+            max_tokens=1024,
+            # force a tool call so the scores always come back matching the schema
+            tools=[{
+                "name": "record_image_scores",
+                "description": "Record the scores for the evaluated image.",
+                "input_schema": ImageValidation.model_json_schema(),
+            }],
+            tool_choice={"type": "tool", "name": "record_image_scores"},
+            messages=[
+                {
                     "role": "user",
                     "content": [
-                        {"type": "text", "text": base_prompt.format(
-                            example_response=json.dumps(example_response), 
-                            image_gen_prompt=json.dumps(image_gen_prompt),
-                        )},
+                        image_part,
                         {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/webp;base64,{base64_image}",
-                        },
-                        },
+                            "type": "text",
+                            "text": VALIDATE_IMAGE_PROMPT.substitute(image_gen_prompt=dumps(image_gen_prompt))
+                        }
                     ],
-                    }
-                ],
-                # max_tokens=200, # no reason to limit this
-            )
+                }
+            ],
+        )
+
+        tool_use = next(block for block in response.content if block.type == "tool_use")
+        return ImageValidation.model_validate(tool_use.input).model_dump()
 
-            return json.loads(response.choices[0].message.content.strip())
+    try:
+        try:
+            return _request(_anthropic_image_part(image_data, image_url))
         except Exception as e:
-            return f"<|Error validating image: {e}|>"        
-    return None
+            if image_url is None or not _is_client_error(e):
+                raise
+            return _request(_anthropic_image_part(image_data))
+    except Exception as e:
+        return f"<|Error validating image: {e}|>"
 
-def validate_generated_image(image_data: bytes, image_gen_prompt: str, model: str = "claude-3-sonnet-20240229"):
+def validate_generated_images(images: list[bytes], prompts: list[str], model: str = "claude-3-sonnet-20240229", batch_size: int = 4, image_urls: list[str] = None):
     """
-    Validate the generated image with the given criteria using Anthropic's Claude API.
+    Validate several generated images with the given criteria, scoring up to batch_size images per Claude call
+    so the rubric is only sent once per batch. Images with an entry in image_urls are sent by reference,
+    if the model supports URL sources.
+    Returns a list aligned with images; images that can't be scored in a batch fall back to validate_generated_image.
     """
-    # Convert bytes to base64
-    base64_image = base64.b64encode(image_data).decode('utf-8')
-    
-    example_response = {"text_accuracy": 8.50,"text_legibility": 7.25,"text_coherence": 9.00,"character_diversity": 6.75,"theme_relevance": 8.50,"emotional_impact": 7.00,"visual_appeal": 8.25,"clarity": 9.50,"cohesiveness": 8.00,"creativity": 7.75,"uplifting_suitability": 8.50}
-
-    base_prompt = """
-    # Instruction
-    You are an expert evaluator of images.
-    You need to evaluate how well the image aligns with the following criteria.
-    Your explanation should be in no more than 1-2 sentences, max 30 words.
-    For each criterion, provide a score between 0.00 and 10.00, using decimal precision to reflect nuance.
-
-    # Grading Criteria
-    - text_accuracy (0-10): The text caption's accuracy and match with the image generation prompt
-    - text_legibility (0-10): How readable and clear the text caption is for humans
-    - text_coherence (0-10): How well the text caption makes sense in the image context
-    - character_diversity (0-10): Diversity of human characters in terms of age, gender, ethnicity, and physical ability
-    - theme_relevance (0-10): How closely the image matches its intended theme or subject
-    - emotional_impact (0-10): How well it evokes positive emotions (joy, hope, inspiration, warmth)
-    - visual_appeal (0-10): Quality of composition, colors, and style, without distracting elements
-    - clarity (0-10): Clarity of content without blur, distortion, or artifacts
-    - cohesiveness (0-10): How harmoniously all elements work together
-    - creativity (0-10): Level of uniqueness and originality, avoiding clichés
-    - uplifting_suitability (0-10): Alignment with light-hearted, joyful narratives
-
-    # Prompt Used to Generate Image
-    {image_gen_prompt}
-
-    Provide a single score between 0.00 (does not meet any criteria) to 10.00 (perfectly meets all criteria), considering all the above aspects.
-    Use decimal precision, rounded to the nearest hundredth to reflect nuance.
-
-    You must return your response in a strict JSON dictionary format on a single line, to be parsed easily by a python function.
-    Your response must not include any backticks, code blocks, or other formatting, as this will break the JSON parsing.
-
-    # Example Response
-    {example_response}
-    """.replace("    ", "").strip()
-
-    for _ in range(3):
+    if not _anthropic_supports_image_urls(model):
+        image_urls = None
+
+    results = [None] * len(images)
+    for start in range(0, len(images), batch_size):
+        batch_indices = range(start, min(start + batch_size, len(images)))
+
+        content = []
+        for idx in batch_indices:
+            content.append({"type": "text", "text": f"# Image {idx}\nPrompt used to generate image: {dumps(prompts[idx])}"})
+            content.append(_anthropic_image_part(images[idx], image_urls[idx] if image_urls else None))
+        content.append({"type": "text", "text": VALIDATE_IMAGES_PROMPT})
+
         try:
             response = anthropic_client.messages.create(
                 model=model,
-                max_tokens=1024,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "image/png",
-                                    "data": base64_image,
-                                },
-                            },
-                            {
-                                "type": "text",
-                                "text": base_prompt.format(
-                                    example_response=json.dumps(example_response),
-                                    image_gen_prompt=json.dumps(image_gen_prompt),
-                                )
-                            }
-                        ],
-                    }
-                ],
+                max_tokens=1024 * len(batch_indices),
+                tools=[{
+                    "name": "record_image_scores",
+                    "description": "Record the scores for each evaluated image.",
+                    "input_schema": ImageValidations.model_json_schema(),
+                }],
+                tool_choice={"type": "tool", "name": "record_image_scores"},
+                messages=[{"role": "user", "content": content}],
             )
 
-            return json.loads(response.content[0].text.strip())
+            tool_use = next(block for block in response.content if block.type == "tool_use")
+            for validation in ImageValidations.model_validate(tool_use.input).validations:
+                if validation.idx in batch_indices:
+                    results[validation.idx] = validation.model_dump(exclude={"idx"})
         except Exception as e:
-            return f"<|Error validating image: {e}|>"        
-    return None
+            # oversized batches (too many image tokens), rejected image URLs and other hard failures
+            # go to the per-image fallback, which retries rejected URLs as base64
+            logger.warning(f"Batch image validation failed, scoring images individually: {e!r}")
+
+    # score any image the batch call missed on its own
+    for idx, result in enumerate(results):
+        if result is None:
+            results[idx] = validate_generated_image(images[idx], prompts[idx], model=model, image_url=image_urls[idx] if image_urls else None)
+
+    return results
@@ -0,0 +1,141 @@
+# utils for caching LLM results and fetched pages across runs
+
+import hashlib
+import json
+import threading
+import diskcache
+import numpy as np
+
+CACHE_VERSION = "v1" # bump this to invalidate all cached results, e.g. after changing a prompt
+CACHE_EXPIRE = 7 * 86400 # 7 days, in seconds
+
+llm_cache = diskcache.Cache("./data/llm_cache")
+page_cache = diskcache.Cache("./data/page_cache")
+
+def story_cache_key(url: str) -> str:
+    """
+    Build the cache key for a story, keyed by its URL.
+    """
+    return hashlib.sha1(f"{url}|{CACHE_VERSION}".encode()).hexdigest()
+
+def get_cached_story(url: str) -> dict:
+    """
+    Get the cached LLM results for a story (e.g. "ranking_info", "webpage_valid"), or an empty dict on a miss.
+    """
+    return llm_cache.get(story_cache_key(url), default={})
+
+def update_cached_story(url: str, **fields):
+    """
+    Merge the given LLM results into the cached entry for a story.
+    """
+    key = story_cache_key(url)
+    entry = llm_cache.get(key, default={})
+    entry.update(fields)
+    llm_cache.set(key, entry, expire=CACHE_EXPIRE)
+
+def get_cached_page(url: str) -> dict | None:
+    """
+    Get the cached fetch of a webpage ("etag", "last_modified", "text"), or None on a miss.
+    """
+    return page_cache.get(url)
+
+def conditional_headers(entry: dict | None) -> dict:
+    """
+    Build the If-None-Match / If-Modified-Since headers to revalidate a cached page, so an unchanged page comes back as a 304.
+    """
+    headers = {}
+    if entry is not None:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+def cache_page(url: str, response_headers, text: str):
+    """
+    Cache a webpage's extracted text with its validators, if the server sent any (otherwise it can't be revalidated).
+    """
+    etag = response_headers.get("etag")
+    last_modified = response_headers.get("last-modified")
+    if etag or last_modified:
+        page_cache.set(url, {"etag": etag, "last_modified": last_modified, "text": text}, expire=CACHE_EXPIRE)
+
+SEMANTIC_THRESHOLD = 0.97 # minimum cosine similarity for a cached response to be reused for a new prompt
+
+# in-memory indexes over the semantic cache entries, one per scope (see `semantic_scope`):
+# scope -> (cache keys, their L2-normalized embeddings as rows)
+_semantic_indexes = None
+_semantic_lock = threading.Lock() # entries are added from worker threads
+
+def prompt_cache_key(*parts) -> str:
+    """
+    Build the cache key for an LLM request from its parts (e.g. model, messages, response format).
+    """
+    return hashlib.sha256(json.dumps([CACHE_VERSION, *parts], sort_keys=True).encode()).hexdigest()
+
+def semantic_scope(model: str, system: str | None, response_format: str | None) -> str:
+    """
+    Build the scope a semantic match must share: only prompts with the same model, instructions and response format
+    are compared, so a response is never reused for a different kind of request.
+    """
+    return prompt_cache_key(model, system, response_format)[:16]
+
+def _load_semantic_indexes():
+    """
+    Build the in-memory semantic indexes from the entries persisted by previous runs.
+    """
+    global _semantic_indexes
+    grouped = {}
+    for key in llm_cache.iterkeys():
+        if isinstance(key, str) and key.startswith("semantic:"):
+            entry = llm_cache.get(key)
+            if entry is not None:
+                scope = key.split(":")[1]
+                keys, vectors = grouped.setdefault(scope, ([], []))
+                keys.append(key)
+                vectors.append(entry[0])
+    _semantic_indexes = {
+        scope: (keys, np.array(vectors, dtype=np.float32))
+        for scope, (keys, vectors) in grouped.items()
+    }
+
+def find_similar_response(scope: str, embedding: list[float]):
+    """
+    Get the cached response, within `scope`, whose prompt embedding is most similar to `embedding`,
+    or None if none reaches `SEMANTIC_THRESHOLD`.
+    """
+    with _semantic_lock:
+        if _semantic_indexes is None:
+            _load_semantic_indexes()
+        if scope not in _semantic_indexes:
+            return None
+        keys, matrix = _semantic_indexes[scope]
+
+        vector = np.asarray(embedding, dtype=np.float32)
+        similarities = matrix @ (vector / np.linalg.norm(vector))
+        best = int(np.argmax(similarities))
+        if similarities[best] < SEMANTIC_THRESHOLD:
+            return None
+        best_key = keys[best]
+
+    entry = llm_cache.get(best_key)
+    return entry[1] if entry is not None else None
+
+def add_similar_response(scope: str, key: str, embedding: list[float], response):
+    """
+    Store a response in the semantic cache under its prompt embedding, within `scope`.
+    """
+    vector = np.asarray(embedding, dtype=np.float32)
+    vector = vector / np.linalg.norm(vector)
+    semantic_key = f"semantic:{scope}:{key}"
+    llm_cache.set(semantic_key, (vector.tolist(), response), expire=CACHE_EXPIRE)
+
+    with _semantic_lock:
+        if _semantic_indexes is None:
+            _load_semantic_indexes()
+            return # the index just loaded already includes this entry
+        if scope in _semantic_indexes:
+            keys, matrix = _semantic_indexes[scope]
+            _semantic_indexes[scope] = (keys + [semantic_key], np.vstack([matrix, vector]))
+        else:
+            _semantic_indexes[scope] = ([semantic_key], vector[None, :])
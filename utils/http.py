@@ -0,0 +1,23 @@
+# utils for pooled HTTP sessions shared across requests
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# transient statuses worth retrying (rate limits and server errors)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+def new_session(pool_size: int = 32, retries: int = 2) -> requests.Session:
+    """
+    Create a requests session whose pooled keep-alive connections are reused across calls to the same host,
+    retrying connection errors and transient statuses with backoff (honoring any retry-after header).
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=retries, backoff_factor=0.2, status_forcelist=RETRY_STATUSES)
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
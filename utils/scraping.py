@@ -1,21 +1,69 @@
 # # Getting Page Text Content
+import asyncio
+import httpx
 import requests
-from bs4 import BeautifulSoup
+from utils.http import new_session
+from utils.cache import get_cached_page, conditional_headers, cache_page
+from selectolax.parser import HTMLParser
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+# shared session so repeat fetches reuse pooled keep-alive connections
+_SESSION = new_session()
+_SESSION.headers.update(HEADERS)
+
+def _extract_text(html: str) -> str:
+    """
+    Extract the visible text from a webpage's HTML.
+    """
+    tree = HTMLParser(html)
+    for tag in tree.css('script,style,noscript'):
+        tag.decompose()
+    return tree.body.text(separator=' ', strip=True) if tree.body else ""
+
 def get_page_text_content(url, timeout=5):
     """
     Get and return the text content of a webpage, with a timeout, headers, and randomized delay.
+    A cached copy is revalidated with its ETag / Last-Modified, and reused if the page hasn't changed.
     """
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    
+    cached = get_cached_page(url)
     try:
-        # Make the request with headers
-        response = requests.get(url, headers=headers, timeout=timeout)
+        # Make the request with headers, revalidating any cached copy
+        response = _SESSION.get(url, headers=conditional_headers(cached), timeout=timeout)
+        if response.status_code == 304 and cached is not None:
+            return cached["text"]
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        text = soup.get_text(separator=' ', strip=True)
-
-        return text
     except requests.RequestException as e:
         return ""
+
+    text = _extract_text(response.text)
+    cache_page(url, response.headers, text)
+    return text
+
+def new_async_client(timeout: int = 5, max_connections: int = 20) -> httpx.AsyncClient:
+    """
+    Create a pooled HTTP/2 async client for fetching webpages. Use it as an async context manager.
+    """
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    return httpx.AsyncClient(http2=True, headers=HEADERS, timeout=timeout, limits=limits, follow_redirects=True)
+
+async def fetch_page_text(client: httpx.AsyncClient, url: str) -> str:
+    """
+    Get the text content of a webpage with the given async client, or an empty string if it couldn't be fetched.
+    A cached copy is revalidated with its ETag / Last-Modified, and reused if the page hasn't changed.
+    """
+    # the disk cache is read and written off the event loop
+    cached = await asyncio.to_thread(get_cached_page, url)
+    try:
+        response = await client.get(url, headers=conditional_headers(cached))
+        if response.status_code == 304 and cached is not None:
+            return cached["text"]
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        return ""
+
+    text = _extract_text(response.text)
+    await asyncio.to_thread(cache_page, url, response.headers, text)
+    return text
@@ -1,10 +1,15 @@
 # # Bing Web Search API
 import os
-import requests
+import httpx
+from utils.http import new_session
+from utils.serialization import loads
 
-def search_bing(search_term: str):
+# shared session so repeat searches reuse pooled keep-alive connections
+_SESSION = new_session()
+
+def _search_request(search_term: str):
     """
-    Search Bing 
+    Build the (url, headers, params) for a Bing search request.
     """
 
     # Define variables
@@ -30,9 +35,28 @@ def search_bing(search_term: str):
         "mkt": "en-CA",
     }
 
-    response = requests.get(search_url, headers=headers, params=params)
+    return search_url, headers, params
+
+def search_bing(search_term: str):
+    """
+    Search Bing 
+    """
+    search_url, headers, params = _search_request(search_term)
+
+    response = _SESSION.get(search_url, headers=headers, params=params)
     response.raise_for_status()
-    search_results = response.json()
+    search_results = loads(response.content)
 
     return search_results
 
+async def search_bing_async(search_term: str, client: httpx.AsyncClient):
+    """
+    Search Bing without blocking the event loop, using the given (shared) async client.
+    """
+    search_url, headers, params = _search_request(search_term)
+
+    response = await client.get(search_url, headers=headers, params=params)
+    response.raise_for_status()
+    search_results = loads(response.content)
+
+    return search_results
@@ -0,0 +1,30 @@
+# utils for fast JSON (de)serialization, using orjson when it's installed
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def loads(data: str | bytes):
+    """
+    Parse JSON from a str or bytes.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps_bytes(obj) -> bytes:
+    """
+    Serialize an object to compact UTF-8 encoded JSON bytes.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def dumps(obj) -> str:
+    """
+    Serialize an object to a compact JSON string.
+    """
+    return dumps_bytes(obj).decode("utf-8")
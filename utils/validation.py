@@ -1,23 +1,28 @@
 # utils for validating search results
 
+# fields a search result must have to be considered
+REQUIRED_FIELDS = ('snippet', 'url', 'isFamilyFriendly', 'name', 'datePublishedFreshnessText', 'datePublished')
+
 def extract_values(data):
     """
     Extract all 'values' from a nested dictionary or list.
+
+    Walks the data with an explicit stack rather than recursion, keeping the values in document order.
     """
     values = []
+    stack = [data]
 
-    def recursive_extract(d):
-        if isinstance(d, dict):
-            for key, value in d.items():
-                if key == 'value' and isinstance(value, list):
-                    values.extend(value)
-                else:
-                    recursive_extract(value)
+    while stack:
+        d = stack.pop()
+        if isinstance(d, tuple):
+            # a 'value' list, queued so it's collected in document order (JSON data never contains tuples)
+            values.extend(d[0])
+        elif isinstance(d, dict):
+            for key, value in reversed(d.items()):
+                stack.append((value,) if key == 'value' and isinstance(value, list) else value)
         elif isinstance(d, list):
-            for item in d:
-                recursive_extract(item)
+            stack.extend(reversed(d))
 
-    recursive_extract(data)
     return values
 
 def only_webpages_news_results(search_results):
@@ -39,13 +44,17 @@ def extract_search_results(search_results):
     # search_results = only_webpages_news_results(search_results)
 
     values = []
+    seen_urls = set() # results are de-duplicated by URL, keeping the first
     for search_result in search_results:
         # extract the values from the search result
         results = extract_values(search_result)
         
         for result in results:
-            required_fields = ['snippet', 'url', 'isFamilyFriendly', 'name', 'datePublishedFreshnessText', 'datePublished']
-            if all(field in result for field in required_fields) and result not in values:
+            if not isinstance(result, dict):
+                continue
+            url = result.get('url')
+            if url and url not in seen_urls and all(field in result for field in REQUIRED_FIELDS):
+                seen_urls.add(url)
                 values.append(result)
                 
     return values